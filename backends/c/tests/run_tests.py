@@ -1,18 +1,36 @@
 #!/usr/bin/env python3
+import argparse
+import atexit
+import functools
+import hashlib
 import os
 import re
+import shlex
 import shutil
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+# Leading blank and "//" lines; metadata is only read from this header.
+HEADER_RE = re.compile(rb"(?:[ \t\r\f\v]*(?://[^\n]*)?(?:\n|\Z))*")
+METADATA_RE = re.compile(rb"^[ \t]*//[ \t]*@([A-Za-z0-9_-]+)[ \t]*:[ \t]*(.*)$", re.MULTILINE)
+SHELL_SYNTAX_RE = re.compile(r"[|&;<>()$`\\*?\[\]{}~!#\n]")
+CASE_NAME_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+CASES_WRAPPER = "cases_main.vx"
+MAX_CASES = 255
+ASSET_SUFFIXES = {".bmp", ".png", ".jpg", ".jpeg", ".bin"}
 
+
+@functools.lru_cache(maxsize=None)
 def find_repo_root(start: Path) -> Path:
     for parent in [start] + list(start.parents):
-        if (parent / ".git").exists():
+        if os.path.exists(os.path.join(parent, ".git")):
             return parent
-        if (parent / "docs" / "vexel-rfc.md").is_file():
+        if os.path.isfile(os.path.join(parent, "docs", "vexel-rfc.md")):
             return parent
     raise RuntimeError("Could not locate repo root")
 
@@ -22,14 +40,16 @@ def parse_metadata(path: Path):
     expect_exit = 0
     expect_stderr = None
     run_generated = False
-    pattern = re.compile(r"^\s*//\s*@([A-Za-z0-9_-]+)\s*:\s*(.*)$")
-
-    for line in path.read_text(encoding="utf-8").splitlines():
-        match = pattern.match(line)
-        if not match:
-            continue
-        key = match.group(1).strip().lower()
-        value = match.group(2).strip()
+    cflags = []
+    cases = []
+
+    # Scan the raw bytes of the header in one pass; only the matched keys and
+    # values are decoded.
+    data = path.read_bytes()
+    header_end = HEADER_RE.match(data).end()
+    for match in METADATA_RE.finditer(data, 0, header_end):
+        key = match.group(1).decode("ascii").lower()
+        value = match.group(2).decode("utf-8").strip()
         if key == "command":
             command = value
         elif key == "expect-exit":
@@ -41,11 +61,21 @@ def parse_metadata(path: Path):
             expect_stderr = value
         elif key == "run-generated":
             run_generated = value.lower() in {"true", "1", "yes"}
+        elif key == "cflags":
+            cflags = shlex.split(value)
+        elif key == "cases":
+            cases = [name for name in re.split(r"[\s,]+", value) if name]
+            for name in cases:
+                if not CASE_NAME_RE.match(name):
+                    raise ValueError(f"Invalid @cases entry in {path}: {name}")
+            # The failing case is reported through the exit status (mod 256).
+            if len(cases) > MAX_CASES:
+                raise ValueError(f"Too many @cases in {path}: {len(cases)} (max {MAX_CASES})")
 
     if not command:
         raise ValueError(f"Missing @command in {path}")
 
-    return command, expect_exit, expect_stderr, run_generated
+    return command, expect_exit, expect_stderr, run_generated, cflags, cases
 
 
 def resolve_build_dir(root: Path) -> Path:
@@ -62,94 +92,383 @@ def replace_macros(command: str, root: Path, build_dir: Path) -> str:
     replacements = {
         "{VEXEL}": str(build_dir / "vexel"),
         "{VEXEL_FRONTEND}": str(build_dir / "vexel-frontend"),
+        "{CASES}": CASES_WRAPPER,
     }
     for key, value in replacements.items():
         command = command.replace(key, value)
     return command
 
 
-def run_command(command: str, cwd: Path):
-    return subprocess.run(
-        command,
-        shell=True,
-        cwd=cwd,
-        capture_output=True,
-        text=True,
-    )
+def write_cases_wrapper(test_file: Path, cases, workdir: Path) -> None:
+    # A mini-suite compiles and runs once: main returns the 1-based index of
+    # the first case that returns non-zero, or 0 when every case passes.
+    module = test_file.stem
+    lines = [
+        f"// Generated by run_tests.py from the @cases of {test_file.name}.",
+        f"::{module};",
+        "",
+        "&^main() -> #i32 {",
+    ]
+    for index, name in enumerate(cases, start=1):
+        lines.append(f"    {module}::{name}() != 0 ? -> {index};")
+    lines += ["    0", "}", ""]
+    (workdir / CASES_WRAPPER).write_text("\n".join(lines), encoding="utf-8")
 
 
-def compile_and_run(cwd: Path):
-    compile_cmd = ["gcc", "-std=c11", "-O2", "out.c", "-o", "out", "-lm"]
-    compile_res = subprocess.run(
-        compile_cmd,
-        cwd=cwd,
-        capture_output=True,
-        text=True,
-    )
-    if compile_res.returncode != 0:
-        return compile_res, None
+def link_or_copy(src: Path, dst: Path) -> None:
+    # Inputs are only read by the test command, so a hardlink is enough;
+    # fall back to a copy across filesystems or where links are unsupported.
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy(src, dst)
+
+
+def stage_input(src: Path, dst: Path) -> None:
+    # Binary fixtures are only read as resources, so a symlink avoids touching
+    # their bytes at all; fall back where symlinks are unavailable (Windows).
+    if src.suffix.lower() in ASSET_SUFFIXES:
+        try:
+            os.symlink(src.resolve(), dst)
+            return
+        except OSError:
+            pass
+    link_or_copy(src, dst)
+
+
+def split_command(command: str):
+    # Plain "prog arg ..." commands are exec'd directly; anything using shell
+    # syntax (pipes, redirects, &&, globs, ...) still goes through /bin/sh.
+    if SHELL_SYNTAX_RE.search(command):
+        return None
+    argv = shlex.split(command)
+    if not argv or "=" in argv[0]:
+        return None
+    return argv
+
+
+def decode_output(data) -> str:
+    return data.decode("utf-8", "replace") if data else ""
+
+
+def rerun_for_output(res, cwd: Path):
+    # Passing runs discard their output; failures are re-run once to report it.
+    again = subprocess.run(res.args, cwd=cwd, capture_output=True)
+    return subprocess.CompletedProcess(res.args, res.returncode, again.stdout, again.stderr)
+
+
+def run_command(command: str, cwd: Path, capture_stdout: bool = False):
+    # stderr is always kept (as bytes) for @expect-stderr; stdout only on request.
+    stdout = subprocess.PIPE if capture_stdout else subprocess.DEVNULL
+    argv = split_command(command)
+    if argv is None:
+        return subprocess.run(
+            command,
+            shell=True,
+            cwd=cwd,
+            stdout=stdout,
+            stderr=subprocess.PIPE,
+        )
+    try:
+        return subprocess.run(
+            argv,
+            cwd=cwd,
+            stdout=stdout,
+            stderr=subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        # Match the shell's "command not found" status.
+        return subprocess.CompletedProcess(argv, 127, b"", f"{argv[0]}: not found\n".encode())
+    except PermissionError:
+        return subprocess.CompletedProcess(argv, 126, b"", f"{argv[0]}: permission denied\n".encode())
+
+
+def command_failure_output(res, command: str, restage):
+    # stdout of the failing run was discarded, so re-run the command in a freshly
+    # staged workdir to recover it; stderr and the status stay from the failing run.
+    cwd = restage()
+    rerun = run_command(command, cwd, capture_stdout=True)
+    return subprocess.CompletedProcess(res.args, res.returncode, rerun.stdout, res.stderr)
+
+
+def resolve_compilers():
+    # Compilers to try, in order, as (argv prefix, flags). VEXEL_TEST_CC pins a
+    # single gcc-compatible compiler; otherwise prefer ccache'd gcc, then tcc
+    # (much faster to start, but only a C subset) with gcc as its fallback.
+    gcc_flags = ["-std=c11", "-O0", "-pipe"]
+    env = os.environ.get("VEXEL_TEST_CC", "").strip()
+    if env:
+        cc = shlex.split(env)
+        flags = ["-std=c11"] if Path(cc[-1]).name == "tcc" else gcc_flags
+        return [(cc, flags)]
+    if shutil.which("ccache"):
+        return [(["ccache", "gcc"], gcc_flags)]
+    if shutil.which("tcc"):
+        return [(["tcc"], ["-std=c11"]), (["gcc"], gcc_flags)]
+    return [(["gcc"], gcc_flags)]
+
+
+COMPILERS = resolve_compilers()
+# Cached binaries not used for this long are pruned at the start of a run.
+CACHE_MAX_AGE_DAYS = 30
+# Names this runner creates in the cache: a digest, or a "<digest>.<pid>.<tid>"
+# staging file left behind by an interrupted store. Nothing else is pruned.
+CACHE_ENTRY_RE = re.compile(r"^[0-9a-f]{32}(?:\.\d+\.\d+)?$")
+
+
+@functools.lru_cache(maxsize=None)
+def compiler_identity() -> bytes:
+    # Ties cached binaries to the exact compiler executables (resolved path,
+    # size, mtime) and their reported version, so an upgraded or different
+    # compiler on PATH never reuses binaries built by the old one.
+    parts = []
+    for cc, _ in COMPILERS:
+        for prog in cc:
+            path = shutil.which(prog)
+            if path is None:
+                parts.append(f"{prog}:missing")
+                continue
+            path = os.path.realpath(path)
+            stat = os.stat(path)
+            parts.append(f"{path}:{stat.st_size}:{stat.st_mtime_ns}")
+        version_flag = "-v" if Path(cc[-1]).name == "tcc" else "--version"
+        try:
+            res = subprocess.run(cc + [version_flag], capture_output=True)
+            parts.append(decode_output(res.stdout) + decode_output(res.stderr))
+        except OSError:
+            parts.append(f"{cc[-1]}:no-version")
+    return "\0".join(parts).encode("utf-8")
+
+
+def resolve_cache_dir() -> Path:
+    env = os.environ.get("VEXEL_TEST_CACHE_DIR", "").strip()
+    if env:
+        return Path(env).expanduser()
+    base = os.environ.get("XDG_CACHE_HOME", "").strip() or "~/.cache"
+    return Path(base).expanduser() / "vexel-tests"
+
+
+def cached_binary_path(cwd: Path, compile_cmds) -> Path:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(compiler_identity() + b"\n")
+    for compile_cmd in compile_cmds:
+        digest.update("\0".join(compile_cmd).encode("utf-8") + b"\n")
+    for name in ("out.c", "out.h"):
+        path = cwd / name
+        if path.is_file():
+            digest.update(b"\0" + name.encode("ascii") + b"\0")
+            digest.update(path.read_bytes())
+    return resolve_cache_dir() / digest.hexdigest()
+
+
+def prune_binary_cache() -> None:
+    cache_dir = resolve_cache_dir()
+    cutoff = time.time() - CACHE_MAX_AGE_DAYS * 24 * 60 * 60
+    try:
+        entries = list(os.scandir(cache_dir))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if (
+                CACHE_ENTRY_RE.match(entry.name)
+                and entry.is_file(follow_symlinks=False)
+                and entry.stat().st_mtime < cutoff
+            ):
+                os.unlink(entry.path)
+        except OSError:
+            pass
+
+
+def store_cached_binary(binary: Path, cached: Path) -> None:
+    # Publish through a rename so concurrent workers never see a partial file.
+    try:
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        staging = cached.with_name(f"{cached.name}.{os.getpid()}.{threading.get_ident()}")
+        link_or_copy(binary, staging)
+        os.replace(staging, cached)
+    except OSError:
+        pass
+
+
+def compile_and_run(cwd: Path, cflags, expect_exit: int):
+    # Generated programs are only checked for their exit status, so skip the
+    # optimizer; tests that need more (e.g. -lm) opt in through @cflags.
+    compile_cmds = [cc + flags + ["out.c", "-o", "out", *cflags] for cc, flags in COMPILERS]
+    cached = cached_binary_path(cwd, compile_cmds)
+    if cached.is_file():
+        link_or_copy(cached, cwd / "out")
+        # Refresh the mtime so entries still in use are not pruned.
+        try:
+            os.utime(cached)
+        except OSError:
+            pass
+        compile_res = subprocess.CompletedProcess(compile_cmds[0], 0, b"", b"")
+    else:
+        for compile_cmd in compile_cmds:
+            compile_res = subprocess.run(
+                compile_cmd,
+                cwd=cwd,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            if compile_res.returncode == 0:
+                break
+        if compile_res.returncode != 0:
+            return rerun_for_output(compile_res, cwd), None
+        store_cached_binary(cwd / "out", cached)
 
     run_res = subprocess.run(
         ["./out"],
         cwd=cwd,
-        capture_output=True,
-        text=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
     )
+    if run_res.returncode != expect_exit:
+        run_res = rerun_for_output(run_res, cwd)
     return compile_res, run_res
 
 
-def run_test(test_file: Path, root: Path) -> str:
-    command, expect_exit, expect_stderr, run_generated = parse_metadata(test_file)
+_worker = threading.local()
+
+
+def worker_dir() -> Path:
+    # Each worker thread reuses one scratch directory for all of its tests.
+    path = getattr(_worker, "dir", None)
+    if path is None:
+        path = Path(tempfile.mkdtemp(prefix="vexel_c_test_"))
+        atexit.register(shutil.rmtree, path, ignore_errors=True)
+        _worker.dir = path
+    return path
+
+
+def clear_dir(path: Path) -> None:
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.unlink(entry.path)
+
+
+def run_test(test_file: Path, root: Path, workdir: Path) -> str:
+    command, expect_exit, expect_stderr, run_generated, cflags, cases = parse_metadata(test_file)
     build_dir = resolve_build_dir(root)
     command = replace_macros(command, root, build_dir)
 
-    with tempfile.TemporaryDirectory(prefix="vexel_c_test_") as tmp:
-        tmp_path = Path(tmp)
+    def stage_workdir() -> Path:
+        clear_dir(workdir)
         for item in test_file.parent.iterdir():
             if item.is_file():
-                shutil.copy(item, tmp_path / item.name)
-
-        compile_res = run_command(command, tmp_path)
-        if run_generated:
-            if compile_res.returncode != 0:
-                return (
-                    f"compile failed (expected 0) for {test_file}.\n"
-                    f"command: {command}\n"
-                    f"stdout:\n{compile_res.stdout}\n"
-                    f"stderr:\n{compile_res.stderr}\n"
-                )
-            gcc_res, run_res = compile_and_run(tmp_path)
-            if gcc_res.returncode != 0:
-                return (
-                    f"gcc failed for {test_file}.\n"
-                    f"stdout:\n{gcc_res.stdout}\n"
-                    f"stderr:\n{gcc_res.stderr}\n"
-                )
-            if run_res is None or run_res.returncode != expect_exit:
-                actual = run_res.returncode if run_res else "unknown"
-                return (
-                    f"runtime exit mismatch for {test_file}: expected {expect_exit}, got {actual}.\n"
-                    f"stdout:\n{run_res.stdout if run_res else ''}\n"
-                    f"stderr:\n{run_res.stderr if run_res else ''}\n"
-                )
-            return ""
-
-        if compile_res.returncode != expect_exit:
+                stage_input(item, workdir / item.name)
+        if cases:
+            write_cases_wrapper(test_file, cases, workdir)
+        return workdir
+
+    stage_workdir()
+
+    compile_res = run_command(command, workdir)
+    if run_generated:
+        if compile_res.returncode != 0:
+            compile_res = command_failure_output(compile_res, command, stage_workdir)
+            return (
+                f"compile failed (expected 0) for {test_file}.\n"
+                f"command: {command}\n"
+                f"stdout (re-run):\n{decode_output(compile_res.stdout)}\n"
+                f"stderr:\n{decode_output(compile_res.stderr)}\n"
+            )
+        if not os.path.exists(os.path.join(workdir, "out.c")):
+            compile_res = command_failure_output(compile_res, command, stage_workdir)
             return (
-                f"exit mismatch for {test_file}: expected {expect_exit}, got {compile_res.returncode}.\n"
+                f"command did not produce out.c for {test_file}.\n"
                 f"command: {command}\n"
-                f"stdout:\n{compile_res.stdout}\n"
-                f"stderr:\n{compile_res.stderr}\n"
+                f"stdout (re-run):\n{decode_output(compile_res.stdout)}\n"
+                f"stderr:\n{decode_output(compile_res.stderr)}\n"
+            )
+        gcc_res, run_res = compile_and_run(workdir, cflags, expect_exit)
+        if gcc_res.returncode != 0:
+            return (
+                f"C compile failed for {test_file}.\n"
+                f"command: {shlex.join(gcc_res.args)}\n"
+                f"stdout:\n{decode_output(gcc_res.stdout)}\n"
+                f"stderr:\n{decode_output(gcc_res.stderr)}\n"
             )
-        if expect_stderr and expect_stderr not in compile_res.stderr:
+        if run_res is not None and cases and expect_exit == 0 and 0 < run_res.returncode <= len(cases):
             return (
-                f"stderr mismatch for {test_file}: expected substring '{expect_stderr}'.\n"
-                f"stderr:\n{compile_res.stderr}\n"
+                f"case '{cases[run_res.returncode - 1]}' failed for {test_file}.\n"
+                f"stdout:\n{decode_output(run_res.stdout)}\n"
+                f"stderr:\n{decode_output(run_res.stderr)}\n"
+            )
+        if run_res is None or run_res.returncode != expect_exit:
+            actual = run_res.returncode if run_res else "unknown"
+            return (
+                f"runtime exit mismatch for {test_file}: expected {expect_exit}, got {actual}.\n"
+                f"stdout:\n{decode_output(run_res.stdout) if run_res else ''}\n"
+                f"stderr:\n{decode_output(run_res.stderr) if run_res else ''}\n"
             )
         return ""
 
+    if compile_res.returncode != expect_exit:
+        compile_res = command_failure_output(compile_res, command, stage_workdir)
+        return (
+            f"exit mismatch for {test_file}: expected {expect_exit}, got {compile_res.returncode}.\n"
+            f"command: {command}\n"
+            f"stdout (re-run):\n{decode_output(compile_res.stdout)}\n"
+            f"stderr:\n{decode_output(compile_res.stderr)}\n"
+        )
+    if expect_stderr and expect_stderr.encode("utf-8") not in compile_res.stderr:
+        return (
+            f"stderr mismatch for {test_file}: expected substring '{expect_stderr}'.\n"
+            f"stderr:\n{decode_output(compile_res.stderr)}\n"
+        )
+    return ""
+
+
+def run_test_in_worker(test_file: Path, root: Path) -> str:
+    return run_test(test_file, root, worker_dir())
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Run the C backend tests.")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of tests to run concurrently (default: CPU count)",
+    )
+    parser.add_argument(
+        "--sequential",
+        action="store_true",
+        help="run tests one at a time (same as --jobs 1)",
+    )
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.sequential:
+        args.jobs = 1
+    return args
+
+
+def run_tests(test_files, root: Path, jobs: int):
+    errors = {}
+    if jobs == 1:
+        for test_file in test_files:
+            errors[test_file] = run_test_in_worker(test_file, root)
+    else:
+        # Each worker thread has its own scratch directory and tests spend their
+        # time blocked on child processes, so threads are enough to overlap them.
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(run_test_in_worker, test_file, root): test_file
+                for test_file in test_files
+            }
+            for future in as_completed(futures):
+                errors[futures[future]] = future.result()
+    return [errors[test_file] for test_file in test_files if errors[test_file]]
+
 
-def main() -> int:
+def main(argv=None) -> int:
+    args = parse_args(argv)
     root = find_repo_root(Path(__file__).resolve())
     tests_root = Path(__file__).resolve().parent
     test_files = sorted(tests_root.rglob("test.vx"))
@@ -157,11 +476,8 @@ def main() -> int:
         print("No backend C tests found.")
         return 0
 
-    failures = []
-    for test_file in test_files:
-        error = run_test(test_file, root)
-        if error:
-            failures.append(error)
+    prune_binary_cache()
+    failures = run_tests(test_files, root, args.jobs)
 
     if failures:
         for error in failures:
@@ -1,27 +1,46 @@
 #!/usr/bin/env python3
 import base64
+from concurrent.futures import ThreadPoolExecutor
 import json
 import os
+import re
+import shlex
 from pathlib import Path
 import sys
 
-if len(sys.argv) != 5:
-    raise SystemExit("usage: embed.py <template> <js> <wasm> <out>")
-
-template_path, js_path, wasm_path, out_path = sys.argv[1:]
-
-template = Path(template_path).read_text()
-js = Path(js_path).read_text()
-wasm = Path(wasm_path).read_bytes()
-wasm_b64 = base64.b64encode(wasm).decode("ascii")
-
-backends_env = os.environ.get("VEXEL_BACKENDS", "").strip()
-backends = backends_env.split() if backends_env else ["c"]
-backends_json = json.dumps(backends)
+USAGE = "usage: embed.py <template> <js> <wasm> <out>\n       embed.py --serve"
 
 playground_dir = Path(__file__).resolve().parent
 repo_root = playground_dir.parent
 tutorial_manifest_path = repo_root / "examples" / "tutorial" / "manifest.json"
+example_root = repo_root / "examples"
+# Lives in the build tree (next to the playground's autoregister.cpp) so it is
+# never published along with the generated page.
+example_cache_path = repo_root / "build" / "playground" / "examples.cache.json"
+
+# Inputs read by build(), keyed by path and reused while their mtime is
+# unchanged. Only matters in --serve mode, where build() runs repeatedly.
+_input_cache = {}
+
+
+def read_input(path, transform=None) -> bytes:
+    key = (os.path.abspath(path), transform)
+    mtime_ns = os.stat(path).st_mtime_ns
+    cached = _input_cache.get(key)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+    data = Path(path).read_bytes()
+    if transform is not None:
+        data = transform(data)
+    _input_cache[key] = (mtime_ns, data)
+    return data
+
+
+def script_json(value) -> bytes:
+    # Compact ASCII JSON that is safe inside <script>: "</" is escaped on the
+    # encoded bytes so no extra copy of the (large) str is made.
+    data = json.dumps(value, separators=(",", ":"), ensure_ascii=True).encode("ascii")
+    return data.replace(b"</", b"<\\/")
 
 
 def encode_example_file(path: Path) -> dict:
@@ -42,25 +61,160 @@ def encode_example_file(path: Path) -> dict:
     }
 
 
-example_root = repo_root / "examples"
-example_files = []
-if example_root.exists():
-    for path in sorted(example_root.rglob("*")):
-        if not path.is_file():
+def walk_files(root):
+    # scandir reports file/dir kinds from the directory listing, so only the
+    # files that end up encoded are stat'ed.
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk_files(entry.path)
+            elif entry.is_file():
+                yield entry
+
+
+def load_example_files() -> list:
+    # Encoded example files are cached keyed by path, size and mtime, so
+    # rebuilds only re-encode the files that changed.
+    example_cache = {}
+    if example_cache_path.exists():
+        try:
+            example_cache = json.loads(example_cache_path.read_text())
+        except ValueError:
+            example_cache = {}
+
+    next_example_cache = {}
+    missing = []
+    if example_root.exists():
+        for entry in walk_files(example_root):
+            stat = entry.stat()
+            rel_path = Path(entry.path).relative_to(repo_root).as_posix()
+            key = f"{rel_path}:{stat.st_size}:{stat.st_mtime_ns}"
+            if key in example_cache:
+                next_example_cache[key] = example_cache[key]
+            else:
+                missing.append((key, Path(entry.path)))
+    if missing:
+        # Only the file reads release the GIL, so threads overlap the I/O; the
+        # UTF-8 decode attempt and base64 encoding still run one at a time.
+        with ThreadPoolExecutor() as executor:
+            encoded_files = executor.map(encode_example_file, [path for _, path in missing])
+            for (key, _), encoded in zip(missing, encoded_files):
+                next_example_cache[key] = encoded
+    example_files = list(next_example_cache.values())
+    # Same order as sorting the Paths: component by component.
+    example_files.sort(key=lambda encoded: encoded["path"].split("/"))
+    if next_example_cache != example_cache:
+        example_cache_path.parent.mkdir(parents=True, exist_ok=True)
+        example_cache_path.write_text(json.dumps(next_example_cache))
+    return example_files
+
+
+def newest_mtime_ns(root) -> int:
+    # Directory mtimes are included so that deleted files also count.
+    newest = os.stat(root).st_mtime_ns
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                newest = max(newest, newest_mtime_ns(entry.path))
+            elif entry.is_file():
+                newest = max(newest, entry.stat().st_mtime_ns)
+    return newest
+
+
+def is_up_to_date(out_path, inputs) -> bool:
+    try:
+        out_mtime_ns = os.stat(out_path).st_mtime_ns
+    except FileNotFoundError:
+        return False
+    newest = max(os.stat(path).st_mtime_ns for path in inputs)
+    if example_root.exists():
+        newest = max(newest, newest_mtime_ns(example_root))
+    return newest <= out_mtime_ns
+
+
+def build(template_path, js_path, wasm_path, out_path) -> None:
+    # VEXEL_BACKENDS is not tracked here; in the Makefile flow a backend change
+    # rebuilds the JS/wasm, which makes the output stale anyway.
+    if is_up_to_date(out_path, [template_path, js_path, wasm_path, __file__]):
+        return
+
+    # Everything is spliced as bytes so the large payloads are never decoded.
+    template = read_input(template_path)
+    js = read_input(js_path)
+    wasm_b64 = read_input(wasm_path, base64.b64encode)
+
+    backends_env = os.environ.get("VEXEL_BACKENDS", "").strip()
+    backends = backends_env.split() if backends_env else ["c"]
+    backends_json = script_json(backends)
+
+    example_files = load_example_files()
+    example_files_json = script_json(example_files)
+
+    tutorial_manifest = []
+    if tutorial_manifest_path.exists():
+        tutorial_manifest = json.loads(tutorial_manifest_path.read_text())
+    tutorial_manifest_json = script_json(tutorial_manifest)
+
+    substitutions = {
+        b"/*__VEXEL_JS__*/": js,
+        b"__VEXEL_WASM_BASE64__": wasm_b64,
+        b"__VEXEL_BACKENDS_JSON__": backends_json,
+        b"__VEXEL_EXAMPLES_JSON__": example_files_json,
+        b"__VEXEL_TUTORIAL_JSON__": tutorial_manifest_json,
+    }
+    placeholder_re = re.compile(b"|".join(map(re.escape, substitutions)))
+
+    # Write the template in one pass instead of chaining str.replace, which would
+    # copy the whole (multi-megabyte) page once per placeholder. The page is
+    # staged next to the output and renamed into place, so an interrupted build
+    # never leaves a truncated file that looks up to date.
+    template_view = memoryview(template)
+    staging_path = f"{out_path}.{os.getpid()}.tmp"
+    try:
+        with open(staging_path, "wb") as out:
+            last = 0
+            for match in placeholder_re.finditer(template):
+                out.write(template_view[last:match.start()])
+                out.write(substitutions[match.group()])
+                last = match.end()
+            out.write(template_view[last:])
+        os.replace(staging_path, out_path)
+    except BaseException:
+        try:
+            os.unlink(staging_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def serve() -> int:
+    # Each stdin line holds shell-quoted "<template> <js> <wasm> <out>"; inputs
+    # stay cached between lines, so the wasm is only re-encoded when it changes.
+    for line in sys.stdin:
+        args = shlex.split(line)
+        if not args:
+            continue
+        if len(args) != 4:
+            print(f"error: {USAGE.splitlines()[0]}", flush=True)
+            continue
+        try:
+            build(*args)
+        except (OSError, ValueError) as exc:
+            print(f"error: {exc}", flush=True)
             continue
-        example_files.append(encode_example_file(path))
-example_files_json = json.dumps(example_files).replace("</", "<\\/")
-
-tutorial_manifest = []
-if tutorial_manifest_path.exists():
-    tutorial_manifest = json.loads(tutorial_manifest_path.read_text())
-tutorial_manifest_json = json.dumps(tutorial_manifest).replace("</", "<\\/")
-
-html = (
-    template.replace("/*__VEXEL_JS__*/", js)
-    .replace("__VEXEL_WASM_BASE64__", wasm_b64)
-    .replace("__VEXEL_BACKENDS_JSON__", backends_json)
-    .replace("__VEXEL_EXAMPLES_JSON__", example_files_json)
-    .replace("__VEXEL_TUTORIAL_JSON__", tutorial_manifest_json)
-)
-Path(out_path).write_text(html)
+        print(f"ok {args[3]}", flush=True)
+    return 0
+
+
+def main(argv=None) -> int:
+    args = sys.argv[1:] if argv is None else argv
+    if args == ["--serve"]:
+        return serve()
+    if len(args) != 4:
+        raise SystemExit(USAGE)
+    build(*args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())